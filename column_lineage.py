@@ -0,0 +1,582 @@
+from sqllineage.runner import LineageRunner
+import pandas as pd
+import re
+import hashlib
+from sqlglot import parse_one, exp
+import os
+import threading
+from collections import OrderedDict, defaultdict
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+from graphlib import CycleError, TopologicalSorter
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+# Precompiled pattern used on every file
+_INVALID_TABLECHARS_RE = re.compile(r'[^a-zA-Z0-9_]')
+
+LINEAGE_COLUMNS = ['source_table', 'source_column', 'derived_table', 'derived_column']
+LineageRow = Tuple[str, str, str, str]
+
+# Cache parsed SQL to avoid redundant parsing; the AST is shared, so callers
+# that mutate it must take a .copy() first
+@lru_cache(maxsize=100)
+def parse_sql_cached(sql: str) -> exp.Expression:
+    return parse_one(sql, read='bigquery')
+
+def _first_of_type(ast: exp.Expression, node_type: type) -> Optional[exp.Expression]:
+    """Breadth-first search for the first node of exactly node_type, without find()'s isinstance checks."""
+    for node in ast.walk():
+        if type(node) is node_type:
+            return node
+    return None
+
+def _lookup_handler(handlers: Dict, node) -> Optional[Callable]:
+    """Finds the handler for a node by exact type, falling back to subclass checks."""
+    handler = handlers.get(type(node))
+    if handler is None:
+        for cls, fn in handlers.items():
+            if isinstance(node, cls):
+                return fn
+    return handler
+
+def _drill_table(source: exp.Table, cte_map: Dict) -> Optional[exp.Expression]:
+    cte = cte_map.get(source.name)
+    return cte.args.get("from", cte).this if cte is not None else None
+
+# Drill-down steps for get_main_table; a None result means stop at the current node
+_MAIN_TABLE_DRILL = {
+    exp.Subquery: lambda source, cte_map: source.this.args.get("from", source.this).this,
+    exp.Alias: lambda source, cte_map: source.this,
+    exp.Table: _drill_table,
+}
+
+def get_main_table(ast: exp.Expression) -> Optional[str]:
+    """Extracts the main source table from a SQL query."""
+    try:
+        # Handle WITH clauses (CTEs)
+        cte_map = {}
+        if ast.args.get("with"):
+            for cte in ast.args["with"].expressions:
+                cte_map[cte.alias] = cte.this
+
+        # Get the main SELECT's FROM clause
+        main_select = _first_of_type(ast, exp.Select)
+        if not main_select or not main_select.args.get("from"):
+            return None
+
+        main_from = main_select.args["from"]
+        first_source = (main_from.args["expressions"][0] 
+                       if main_from.args.get("expressions") 
+                       else main_from.this)
+
+        # Drill down through subqueries and aliases
+        while True:
+            handler = _lookup_handler(_MAIN_TABLE_DRILL, first_source)
+            next_source = handler(first_source, cte_map) if handler else None
+            if next_source is None:
+                break
+            first_source = next_source
+
+        return first_source.sql() if isinstance(first_source, exp.Table) else None
+    except Exception as e:
+        print(f"Warning: Table extraction failed - {str(e)}")
+        return None
+
+def _walk_once(ast: exp.Expression) -> Tuple[List[exp.Select], Dict]:
+    """Walks the AST once, collecting SELECTs and grouping tables by enclosing CTE alias."""
+    selects = []
+    tables = []
+    for node in ast.walk():
+        node_type = type(node)
+        if node_type is exp.Select:
+            selects.append(node)
+        elif node_type is exp.Table:
+            tables.append(node)
+    
+    cte_tables = defaultdict(list)
+    for table in tables:
+        cte = table.find_ancestor(exp.CTE)
+        while cte:
+            cte_tables[cte.alias].append(table)
+            cte = cte.find_ancestor(exp.CTE)
+    
+    return selects, cte_tables
+
+def _build_cte_schema(cte: exp.CTE, cte_names: Set[str], tables: Optional[List] = None) -> Dict:
+    """Builds the column definitions and source references for a single CTE."""
+    select = cte.this
+    
+    # Get column definitions; selects also resolves a UNION to its first branch's projections
+    columns = {}
+    for i, expr in enumerate(select.selects):
+        if isinstance(expr, exp.Alias):
+            col_name = expr.alias
+            col_expr = expr.this.sql()
+        elif isinstance(expr, exp.Column) and isinstance(expr.this, exp.Star):
+            # Keep the qualifier so t.* and u.* stay separate entries
+            col_name = f"{expr.table}.*"
+            col_expr = expr.sql()
+        else:
+            # Names come straight off the node; only the expression text is serialized
+            col_name = expr.alias_or_name if isinstance(expr, (exp.Column, exp.Star)) else ""
+            col_expr = expr.sql()
+        columns[col_name or f"col_{i+1}"] = col_expr
+    
+    # Get source references
+    source_tables = set()
+    source_ctes = set()
+    
+    if tables is None:
+        tables = [node for node in select.walk() if type(node) is exp.Table]
+    for table in tables:
+        table_name = table.sql()
+        if table.name in cte_names:
+            source_ctes.add(table.name)
+        else:
+            source_tables.add(table_name)
+    
+    return {
+        "columns": columns,
+        "source_tables": sorted(source_tables),
+        "source_ctes": sorted(source_ctes)
+    }
+
+class _LazyCteSchemas(Mapping):
+    """CTE schemas built on first lookup and rebuilt only after their CTE is marked dirty."""
+
+    def __init__(self, ctes: Dict[str, exp.CTE], cte_tables: Dict, initial: Optional[Dict] = None):
+        self._ctes = ctes
+        self._cte_names = set(ctes)
+        self._cte_tables = cte_tables
+        self._schemas = dict(initial or {})
+        self._dirty: Set[str] = set()
+
+    def mark_dirty(self, alias: str):
+        self._dirty.add(alias)
+
+    def __getitem__(self, alias: str) -> Dict:
+        if alias in self._ctes and (alias in self._dirty or alias not in self._schemas):
+            self._schemas[alias] = _build_cte_schema(
+                self._ctes[alias], self._cte_names, self._cte_tables.get(alias, [])
+            )
+            self._dirty.discard(alias)
+        return self._schemas[alias]
+
+    def __contains__(self, alias) -> bool:
+        return alias in self._ctes or alias in self._schemas
+
+    def __iter__(self):
+        return iter(self._ctes.keys() | self._schemas.keys())
+
+    def __len__(self) -> int:
+        return len(self._ctes.keys() | self._schemas.keys())
+
+def get_cte_schemas(ast: exp.Expression) -> Dict:
+    """Returns CTE schemas with column definitions and source references."""
+    if not ast.args.get("with"):
+        return {}
+
+    cte_names = {cte.alias for cte in ast.args["with"].expressions}
+    return {cte.alias: _build_cte_schema(cte, cte_names) for cte in ast.args["with"].expressions}
+
+def expand_all_stars(ast: exp.Expression, cte_schemas: Dict = None, debug: bool = False) -> exp.Expression:
+    """Expands stars in CTEs in dependency order, then in the main query."""
+    # Fast path: fully qualified queries stop at the first walk without a star
+    # (t.* is a Column wrapping a Star, so it is caught here too)
+    if not any(type(node) is exp.Star for node in ast.walk()):
+        if debug:
+            print("No stars to expand")
+        return ast
+    
+    # Expansion only rewrites projections, so the SELECT and table nodes found
+    # by a single walk stay valid throughout
+    selects, cte_tables = _walk_once(ast)
+    main_select = selects[0] if selects else None
+    
+    # Schemas are only built for CTEs a star actually resolves against; a wrapped
+    # query hangs its WITH off the INSERT's SELECT rather than the root
+    query = ast.expression if type(ast) is exp.Insert else ast
+    ctes = {cte.alias: cte for cte in query.args["with"].expressions} if query.args.get("with") else {}
+    cte_schemas = _LazyCteSchemas(ctes, cte_tables, cte_schemas)
+    
+    # Expand each CTE once, after every CTE it reads from
+    if ctes:
+        cte_names = set(ctes)
+        deps = {
+            alias: {t.name for t in cte_tables.get(alias, []) if t.name in cte_names and t.name != alias}
+            for alias in ctes
+        }
+        try:
+            order = list(TopologicalSorter(deps).static_order())
+        except CycleError:
+            if debug:
+                print("Warning: Cyclic CTE references, expanding in definition order")
+            order = list(ctes)
+        
+        for alias in order:
+            # Only plain SELECT bodies are expanded; UNION and recursive CTE
+            # bodies keep their projections so the schema can still read them
+            if type(ctes[alias].this) is not exp.Select:
+                continue
+            if debug:
+                print(f"\nExpanding stars in CTE: {alias}")
+            if expand_select_star(ctes[alias].this, cte_schemas, debug):
+                cte_schemas.mark_dirty(alias)
+    
+    # Expand main query
+    if main_select:
+        if debug:
+            print("\nExpanding stars in main query")
+        expand_select_star(main_select, cte_schemas, debug)
+    
+    return ast
+
+def expand_select_star(select: exp.Select, cte_schemas: Dict, debug: bool = False) -> bool:
+    """Expands stars in a single SELECT statement, returning whether any star was processed."""
+    if debug:
+        print("\nProcessing SELECT:", select.sql())
+    
+    from_source = select.args.get("from")
+    from_tables = get_source_tables(from_source, cte_schemas) if from_source else []
+    
+    join_tables = []
+    for join in select.args.get("joins", []):
+        join_tables.extend(get_source_tables(join.this, cte_schemas))
+    
+    all_sources = from_tables + join_tables
+    if debug:
+        print(f"Available sources: {all_source_names(all_sources)}")
+    
+    new_exprs = []
+    expanded = False
+    for expr in select.args.get("expressions", []):
+        if isinstance(expr, exp.Star):
+            if debug:
+                print("Processing unqualified *")
+            handle_unqualified_star(expr, all_sources, cte_schemas, new_exprs, debug)
+            expanded = True
+        elif isinstance(expr, exp.Column) and isinstance(expr.this, exp.Star):
+            if debug:
+                print(f"Processing qualified {expr.sql()}")
+            handle_qualified_star(expr, cte_schemas, new_exprs, debug)
+            expanded = True
+        else:
+            if debug:
+                print(f"Keeping existing expression: {expr.sql()}")
+            new_exprs.append(expr)
+    
+    select.set("expressions", new_exprs)
+    if debug:
+        print("New expressions:", [e.sql() for e in new_exprs])
+    return expanded
+
+def handle_unqualified_star(star, sources, cte_schemas, new_exprs, debug):
+    """Handle unqualified * expansion"""
+    if not any(source["name"] in cte_schemas for source in sources):
+        # No CTE to expand from, so the star stays as written
+        new_exprs.append(star)
+        return
+    
+    for source in sources:
+        if source["name"] in cte_schemas:
+            if debug:
+                print(f"Expanding {source['alias']}.* from CTE {source['name']}")
+            expand_cte_columns(source, cte_schemas, new_exprs, debug)
+        else:
+            if debug:
+                print(f"Keeping {source['alias']}.* - not a CTE")
+            new_exprs.append(exp.Column(
+                this=exp.Star(**{
+                    "except": star.args.get("except"),
+                    "replace": star.args.get("replace")
+                }),
+                table=exp.to_identifier(source["alias"])
+            ))
+
+def handle_qualified_star(column, cte_schemas, new_exprs, debug):
+    """Handle table.* expansion"""
+    table_name = column.args["table"]
+    if table_name in cte_schemas:
+        if debug:
+            print(f"Expanding {table_name}.* from CTE")
+        expand_cte_columns({
+            "name": table_name,
+            "alias": table_name,
+            "is_cte": True
+        }, cte_schemas, new_exprs, debug)
+    else:
+        if debug:
+            print(f"Keeping {table_name}.* - not a CTE")
+        new_exprs.append(column)
+
+def expand_cte_columns(source, cte_schemas, new_exprs, debug):
+    """Expand columns from a CTE source"""
+    star_added = False
+    for col_name in cte_schemas[source["name"]]["columns"]:
+        if col_name.endswith("*"):
+            # The CTE still selects a star over a non-CTE source, so its columns
+            # aren't known here; one alias.* stands in for all of them
+            if star_added:
+                continue
+            new_col = exp.Column(this=exp.Star(), table=exp.to_identifier(source["alias"]))
+            star_added = True
+        else:
+            new_col = exp.column(col_name, table=source["alias"])
+        new_exprs.append(new_col)
+        if debug:
+            print(f"Added column: {new_col.sql()}")
+
+def all_source_names(sources):
+    """Helper for debug output"""
+    return [f"{s['name']} (as {s['alias']})" for s in sources]
+
+def _table_source(source, cte_schemas):
+    return [{
+        "name": source.name,
+        "alias": source.alias or source.name,
+        "is_cte": source.name in cte_schemas
+    }]
+
+def _alias_source(source, cte_schemas):
+    if isinstance(source.this, exp.Table):
+        return [{
+            "name": source.this.name,
+            "alias": source.alias,
+            "is_cte": source.this.name in cte_schemas
+        }]
+    elif isinstance(source.this, exp.Subquery):
+        return [{
+            "name": source.alias,  # For subqueries, the alias becomes the name
+            "alias": source.alias,
+            "is_cte": False
+        }]
+    return []
+
+def _subquery_source(source, cte_schemas):
+    return [{
+        "name": source.alias,
+        "alias": source.alias,
+        "is_cte": False
+    }] if source.alias else []
+
+_SOURCE_TABLE_HANDLERS = {
+    exp.From: lambda source, cte_schemas: get_source_tables(source.this, cte_schemas),
+    exp.Table: _table_source,
+    exp.Alias: _alias_source,
+    exp.Subquery: _subquery_source,
+}
+
+def get_source_tables(source, cte_schemas):
+    """Handle all possible source types and return consistent table info"""
+    handler = _lookup_handler(_SOURCE_TABLE_HANDLERS, source)
+    return handler(source, cte_schemas) if handler else []
+
+def apply_replacements(sql: str, replacements: Dict) -> str:
+    """Applies placeholder replacements one key at a time, in dictionary order."""
+    # Kept sequential on purpose: later keys see earlier results, which a
+    # single-pass alternation can't reproduce for chained or overlapping keys
+    for old, new in replacements.items():
+        sql = sql.replace(old, new)
+    return sql
+
+def wrap_select_with_insert(sql: str, replacements: Dict, filename: Optional[str] = None) -> str:
+    """Wraps the final SELECT with an INSERT statement."""
+    try:
+        # Apply replacements first
+        sql = apply_replacements(sql, replacements)
+        
+        ast = parse_sql_cached(sql)
+        main_select = _first_of_type(ast, exp.Select)
+        
+        if not main_select:
+            raise ValueError("No SELECT found in query")
+            
+        # Generate column list from each projection's output name, keeping positions aligned
+        output_columns = [
+            name if (name := expr.output_name) and name != "*" else f"col_{i+1}"
+            for i, expr in enumerate(main_select.selects)
+        ]
+        
+        if filename:
+            target_table = target_table_name(filename)
+        else:
+            # Fallback to original behavior if no filename provided
+            from_table = get_main_table(ast) or "unknown"
+            target_table = f"dummy_{from_table.split('.')[-1]}"
+        
+        # Build final SQL
+        insert_stmt = f"INSERT INTO {target_table} ({', '.join(output_columns)})"
+        return f"{insert_stmt}\n{ast.sql()}"
+        
+    except Exception as e:
+        print(f"Warning: Couldn't wrap query - {str(e)}")
+        return sql  # Fallback to original
+
+def target_table_name(filename: str) -> str:
+    """Derives the INSERT target table from a SQL file name."""
+    # Remove .sql extension and replace invalid characters with _
+    return _INVALID_TABLECHARS_RE.sub('_', os.path.splitext(filename)[0])
+
+_DEFAULT_PREFIX = '<default>.'
+
+def clean_lineage_tuple(variable: List[str]) -> List[str]:
+    """Cleans lineage tuples by removing default schema references."""
+    # sqllineage only ever emits <default>. as a leading prefix
+    return [v[len(_DEFAULT_PREFIX):] if v.startswith(_DEFAULT_PREFIX) else v for v in variable]
+
+def split_lineage_name(name: str) -> Tuple[str, str]:
+    """Splits a "table.column" name on its last dot, using <unknown> for bare column names."""
+    if '.' in name:
+        table, column = name.rsplit('.', 1)
+        return table, column
+    return "<unknown>", name
+
+def _process_sql(sql: str, replacements: Dict, filename: Optional[str], modify: bool = True) -> str:
+    """Star-expands and wraps SQL, returning the processed SQL text."""
+    if modify:
+        sql = apply_replacements(sql, replacements)
+    
+    # Parse and expand stars; expansion rewrites the AST in place, so work on a copy
+    ast = parse_sql_cached(sql).copy()
+    expanded_sql = expand_all_stars(ast).sql()
+    
+    # Wrap after expanding, so the INSERT column list names the expanded projections
+    if modify:
+        return wrap_select_with_insert(expanded_sql, {}, filename)
+    return expanded_sql
+
+# Cache processed SQL for repeated files, keyed by a digest so the original SQL isn't retained.
+# Files are wrapped with a fixed target so identical SQL shares an entry (and a lineage run)
+# whatever its file name; extract_lineage_rows puts the real target table back.
+_PROCESSED_SQL_CACHE_SIZE = 512
+_processed_sql_cache: "OrderedDict[str, str]" = OrderedDict()
+_processed_sql_lock = threading.Lock()
+_TARGET_PLACEHOLDER = '__lineage_target__'
+
+def _processed_sql(sql: str, replacements: Dict, filename: Optional[str], modify: bool = True) -> str:
+    """Returns the processed SQL text, wrapped with the placeholder target when a filename is given."""
+    wrap_target = _TARGET_PLACEHOLDER if filename else None
+    digest = hashlib.sha1(sql.encode('utf-8'))
+    digest.update(repr((tuple(replacements.items()), wrap_target, modify)).encode('utf-8'))
+    key = digest.hexdigest()
+    
+    with _processed_sql_lock:
+        processed_sql = _processed_sql_cache.get(key)
+        if processed_sql is not None:
+            _processed_sql_cache.move_to_end(key)
+    
+    if processed_sql is None:
+        processed_sql = _process_sql(sql, replacements, wrap_target, modify)
+        with _processed_sql_lock:
+            _processed_sql_cache[key] = processed_sql
+            if len(_processed_sql_cache) > _PROCESSED_SQL_CACHE_SIZE:
+                _processed_sql_cache.popitem(last=False)
+    return processed_sql
+
+def lineage_frame(rows) -> pd.DataFrame:
+    """Builds the lineage DataFrame from row tuples; the column list also shapes an empty frame."""
+    return pd.DataFrame(list(rows), columns=LINEAGE_COLUMNS)
+
+# Cache sqllineage results so identical processed SQL is only re-parsed once
+@lru_cache(maxsize=256)
+def _run_lineage(sql: str) -> Tuple[Tuple[str, ...], ...]:
+    """Runs sqllineage and materializes each column lineage path as a tuple of strings."""
+    return tuple(
+        tuple(str(col) for col in lineage_tuple)
+        for lineage_tuple in LineageRunner(sql).get_column_lineage()
+    )
+
+def extract_lineage_rows(sql: str, replacements: Dict, filename: Optional[str] = None,
+                         modify: bool = True) -> List[LineageRow]:
+    """Extracts column lineage from SQL query as unique row tuples in extraction order."""
+    try:
+        processed_sql = _processed_sql(sql, replacements, filename, modify)
+        # sqllineage lower-cases table names, so the file's target is matched the same way
+        target_table = target_table_name(filename).lower() if filename else _TARGET_PLACEHOLDER
+        
+        # Extract lineage, splitting table.column names here rather than in pandas
+        # and deduplicating as rows are produced (a dict keeps first-seen order)
+        lineage_rows: Dict[LineageRow, None] = {}
+        for chain in _run_lineage(processed_sql):
+            try:
+                cleaned_chain = [
+                    (target_table if tbl == _TARGET_PLACEHOLDER else tbl, col)
+                    for tbl, col in map(split_lineage_name, clean_lineage_tuple(chain))
+                ]
+                
+                for i in range(len(cleaned_chain) - 1):
+                    der_tbl, der_col = cleaned_chain[i]
+                    src_tbl, src_col = cleaned_chain[i + 1]
+                    lineage_rows[(src_tbl, src_col, der_tbl, der_col)] = None
+            except Exception as e:
+                print(f"Skipping lineage tuple due to error: {str(e)}")
+                continue
+        
+        return list(lineage_rows)
+    
+    except Exception as e:
+        print(f"Lineage extraction failed: {str(e)}")
+        return []
+
+def extract_column_lineage(sql: str, replacements: Dict, filename: Optional[str] = None,
+                           modify: bool = True) -> pd.DataFrame:
+    """Extracts column lineage from SQL query."""
+    return lineage_frame(extract_lineage_rows(sql, replacements, filename, modify))
+
+def process_sql_file_rows(file_path: str, replacements: Dict) -> List[LineageRow]:
+    """Processes a single SQL file and returns its lineage row tuples."""
+    try:
+        # utf-8-sig also strips a BOM, which would otherwise break parsing
+        sql = Path(file_path).read_text(encoding='utf-8-sig').strip()
+        if not sql:
+            print(f"Skipping empty file: {file_path}")
+            return []
+        
+        # Get just the filename without path
+        filename = os.path.basename(file_path)
+        return extract_lineage_rows(sql, replacements, filename)
+    except Exception as e:
+        print(f"Error processing {file_path}: {str(e)}")
+        return []
+
+def process_sql_file(file_path: str, replacements: Dict) -> pd.DataFrame:
+    """Processes a single SQL file and returns lineage DataFrame."""
+    return lineage_frame(process_sql_file_rows(file_path, replacements))
+
+def process_sql_folder(folder_path: str, replacements: Dict) -> pd.DataFrame:
+    """Processes all SQL files in a folder and returns combined lineage."""
+    with os.scandir(folder_path) as entries:
+        sql_files = [
+            entry.path 
+            for entry in entries 
+            if entry.is_file() and entry.name.endswith('.sql')
+        ]
+    
+    # Process files in parallel; parsing is CPU-bound, so use processes rather than threads
+    # Workers return compact row lists, merged here so dedup happens as results arrive;
+    # map() yields in file order, so the output order is stable across runs
+    all_rows: Dict[LineageRow, None] = {}
+    with ProcessPoolExecutor() as executor:
+        for rows in executor.map(
+            partial(process_sql_file_rows, replacements=replacements), 
+            sql_files,
+            chunksize=4
+        ):
+            all_rows.update(dict.fromkeys(rows))
+    
+    return lineage_frame(all_rows)
+
+# Example usage
+if __name__ == "__main__":
+    replacements = {
+        '[$target_dataset].': '',
+        '"[$run_type]"': 'runtype',
+        "'[$run_type]'": 'runtype',
+        '[$regulator_table]': 'EBA'
+    }
+    
+    folder_path = r"C:\Users\data\sql_files"
+    master_lineage_df = process_sql_folder(folder_path, replacements)
+    print(f"Processed {len(master_lineage_df)} lineage records")
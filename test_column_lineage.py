@@ -0,0 +1,27 @@
+import pytest
+
+from column_lineage import expand_all_stars, parse_sql_cached, wrap_select_with_insert
+
+
+@pytest.mark.parametrize("sql, expected", [
+    # Stars over UNION and recursive CTEs expand to the CTE's columns
+    ("WITH a AS (SELECT x FROM t UNION ALL SELECT x FROM u) SELECT * FROM a",
+     "WITH a AS (SELECT x FROM t UNION ALL SELECT x FROM u) SELECT a.x FROM a"),
+    ("WITH RECURSIVE r AS (SELECT 1 AS n UNION ALL SELECT n + 1 FROM r WHERE n < 3) SELECT * FROM r",
+     "WITH RECURSIVE r AS (SELECT 1 AS n UNION ALL SELECT n + 1 FROM r WHERE n < 3) SELECT r.n FROM r"),
+    # A star the CTE can't resolve stays a qualified star, once
+    ("WITH a AS (SELECT * FROM t) SELECT * FROM a",
+     "WITH a AS (SELECT * FROM t) SELECT a.* FROM a"),
+    ("WITH a AS (SELECT x FROM t) SELECT * FROM a JOIN u ON a.x = u.x",
+     "WITH a AS (SELECT x FROM t) SELECT a.x, u.* FROM a JOIN u ON a.x = u.x"),
+])
+def test_expand_all_stars(sql, expected):
+    assert expand_all_stars(parse_sql_cached(sql).copy()).sql() == expected
+
+
+def test_expand_all_stars_wrapped_insert():
+    # The INSERT root carries the query's WITH on its SELECT
+    sql = wrap_select_with_insert("WITH a AS (SELECT x, y FROM t) SELECT * FROM a", {}, "f.sql")
+    assert expand_all_stars(parse_sql_cached(sql).copy()).sql() == (
+        "INSERT INTO f (col_1) WITH a AS (SELECT x, y FROM t) SELECT a.x, a.y FROM a"
+    )